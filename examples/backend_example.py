@@ -6,15 +6,20 @@ FastAPI + Qdrant + OpenAI
 from fastapi import FastAPI, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import openai
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from sentence_transformers import SentenceTransformer
+import torch
 import PyPDF2
 import io
-from sklearn.metrics.pairwise import cosine_similarity
+import asyncio
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import re
+from itertools import chain
 
 app = FastAPI()
 
@@ -28,10 +33,70 @@ app.add_middleware(
 )
 
 # Initialize services
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-vector_db = QdrantClient("localhost", port=6333)
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+if torch.cuda.is_available():
+    # fp16 halves memory traffic with negligible effect on rankings (it can
+    # reorder near-ties). Vectors stored by earlier fp32/CPU runs stay mixed
+    # with new fp16/GPU ones; re-index a collection to make them uniform.
+    embedding_model = embedding_model.to('cuda').half()
+    torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision('high')
+
+# Multi-GPU worker pool for bulk ingestion, started at startup when more
+# than one GPU is visible. Interactive queries always use embedding_model
+# directly, where latency matters more than throughput. The pool runs on
+# its own model instance: starting it moves its parent model to the CPU.
+# Its output queue is shared, so only one upload may encode through it
+# at a time (results are matched back by chunk number, not by caller).
+pool_model = None
+embedding_pool = None
+embedding_pool_lock = threading.Lock()
+# gRPC has lower per-call overhead than REST for small search requests
+vector_db = QdrantClient("localhost", port=6333, grpc_port=6334, prefer_grpc=True)
 openai.api_key = "your-api-key"
 
+# Max points embedded and sent to Qdrant per upsert request
+UPSERT_BATCH_SIZE = 256
+
+# Text extraction splits each uploaded PDF into this many page ranges, run
+# on a shared pool. PyPDF2 is pure Python and holds the GIL, so extra
+# threads only overlap the parts that release it (stream decompression);
+# hence the small cap rather than one thread per core.
+PDF_EXTRACT_WORKERS = 4
+pdf_extract_pool = ThreadPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, thread_name_prefix="pdf-extract")
+# Every range re-parses the PDF's structure with its own reader, so
+# smaller files are extracted as a single range
+PDF_SPLIT_MIN_BYTES = 1_000_000
+
+# Vectors are stored as int8 (4x smaller than float32) and kept in RAM;
+# searches prefetch a wider candidate pool from the quantized index, then
+# rescore it with the original vectors to preserve recall
+VECTOR_QUANTIZATION = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8,
+        quantile=0.99,
+        always_ram=True,
+    )
+)
+PREFETCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=False)
+)
+SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=128,
+    exact=False,
+    quantization=models.QuantizationSearchParams(rescore=True),
+)
+PREFETCH_FACTOR = 4  # candidates fetched per requested result
+# Quantization the "documents" collection actually uses, read back by
+# ensure_collection() at startup and reported in query metadata
+vector_quantization = "none"
+
+# Sentence boundary: whitespace following terminal punctuation
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+# Whitespace-delimited word, used for chunking
+WORD_RE = re.compile(r'\S+')
+
 # ============================================================================
 # REQUEST/RESPONSE MODELS
 # ============================================================================
@@ -64,15 +129,92 @@ class QueryResponse(BaseModel):
 # HELPER FUNCTIONS
 # ============================================================================
 
-def split_into_sentences(text: str) -> List[str]:
-    """Split text into sentences"""
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s.strip() for s in sentences if s.strip() and len(s.strip()) > 20]
+def split_into_sentences(text: str) -> List[Tuple[str, int]]:
+    """
+    Split text into sentences
+    Returns (sentence, start_offset) pairs, with offsets taken from the split
+    itself so callers never have to search the text for a sentence again
+    """
+    sentences = []
+    start = 0
+    for boundary in chain(SENTENCE_SPLIT_RE.finditer(text), [None]):
+        end = boundary.start() if boundary else len(text)
+        raw = text[start:end]
+        sentence = raw.strip()
+        if len(sentence) > 20:
+            sentences.append((sentence, start + len(raw) - len(raw.lstrip())))
+        if boundary:
+            start = boundary.end()
+    
+    return sentences
 
-def extract_highlights(chunk_text: str, query: str, max_highlights: int = 3) -> List[Dict]:
+def select_highlights(
+    sentences: List[Tuple[str, int]], similarities: np.ndarray, max_highlights: int = 3
+) -> List[Dict]:
+    """
+    Pick the top N sentences by similarity as highlight regions
+    """
+    # Get indices of top N most similar sentences, best first. argpartition
+    # selects them in O(n); only those k are then sorted
+    k = min(max_highlights, len(similarities))
+    if k <= 0:
+        return []
+    top_k = np.argpartition(-similarities, k - 1)[:k]
+    top_indices = top_k[np.argsort(-similarities[top_k])]
+    
+    highlights = []
+    for idx in top_indices:
+        # Only include if similarity is above threshold
+        if similarities[idx] > 0.5:
+            sentence, start_offset = sentences[idx]
+            highlights.append({
+                "text": sentence,
+                "startOffset": start_offset,
+                "endOffset": start_offset + len(sentence)
+            })
+    
+    return highlights
+
+def encode_texts(texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Embed texts as unit-length vectors (one row per text)"""
+    embeddings = embedding_model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    # The model may run in fp16 on GPU; keep scoring and storage in fp32
+    return embeddings.astype(np.float32, copy=False)
+
+def encode_chunks(texts: List[str]) -> np.ndarray:
+    """
+    Embed document chunks for ingestion
+    Uses the multi-GPU pool when running, splitting texts evenly per device
+    """
+    if embedding_pool is None:
+        return encode_texts(texts, batch_size=64)
+    
+    per_device = -(-len(texts) // len(embedding_pool["processes"]))
+    with embedding_pool_lock:
+        embeddings = pool_model.encode_multi_process(
+            texts,
+            embedding_pool,
+            batch_size=64,
+            chunk_size=max(1, per_device),
+            normalize_embeddings=True,
+        )
+    return embeddings.astype(np.float32, copy=False)
+
+def extract_highlights(
+    chunk_text: str, query_embedding: np.ndarray, max_highlights: int = 3
+) -> List[Dict]:
     """
     Extract most relevant sentences from chunk based on semantic similarity to query
     Returns list of highlights with exact character positions
+    
+    query_embedding must be the normalized query vector already computed for
+    the vector DB search, so the query is never re-encoded per chunk.
     """
     # Split chunk into sentences
     sentences = split_into_sentences(chunk_text)
@@ -80,49 +222,148 @@ def extract_highlights(chunk_text: str, query: str, max_highlights: int = 3) ->
     if not sentences:
         return []
     
-    # Encode query and sentences
-    query_embedding = embedding_model.encode(query)
-    sentence_embeddings = embedding_model.encode(sentences)
+    sentence_embeddings = encode_texts([sentence for sentence, _ in sentences])
     
-    # Calculate cosine similarity between query and each sentence
-    similarities = cosine_similarity([query_embedding], sentence_embeddings)[0]
+    # Embeddings are unit-length, so cosine similarity is a plain dot product
+    similarities = sentence_embeddings @ query_embedding
     
-    # Get indices of top N most similar sentences
-    top_indices = np.argsort(similarities)[-max_highlights:][::-1]
+    return select_highlights(sentences, similarities, max_highlights)
+
+def extract_highlights_batch(
+    chunk_texts: List[str], query_embedding: np.ndarray, max_highlights: int = 3
+) -> List[List[Dict]]:
+    """
+    Extract highlights for several chunks with a single encode call.
+    Sentences from every chunk are embedded together, then the similarity
+    vector is sliced back into per-chunk views.
+    """
+    chunk_sentences = [split_into_sentences(text) for text in chunk_texts]
+    all_sentences = [sentence for sentences in chunk_sentences for sentence, _ in sentences]
     
-    highlights = []
-    for idx in top_indices:
-        # Only include if similarity is above threshold
-        if similarities[idx] > 0.5:
-            sentence = sentences[idx]
-            
-            # Find exact position of this sentence in the original chunk text
-            start_offset = chunk_text.find(sentence)
-            
-            if start_offset != -1:  # Sentence found in chunk
-                highlights.append({
-                    "text": sentence,
-                    "startOffset": start_offset,
-                    "endOffset": start_offset + len(sentence)
-                })
+    if not all_sentences:
+        return [[] for _ in chunk_texts]
     
-    return highlights
+    # offsets[i]:offsets[i + 1] is the slice of all_sentences belonging to chunk i
+    offsets = np.cumsum([0] + [len(sentences) for sentences in chunk_sentences])
+    
+    similarities = encode_texts(all_sentences, batch_size=128) @ query_embedding
+    
+    return [
+        select_highlights(sentences, similarities[offsets[i]:offsets[i + 1]], max_highlights)
+        if sentences else []
+        for i, sentences in enumerate(chunk_sentences)
+    ]
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    """Split text into overlapping chunks"""
-    words = text.split()
-    chunks = []
+def search_chunks(
+    query_embedding: np.ndarray, limit: int, score_threshold: Optional[float] = None
+) -> List[models.ScoredPoint]:
+    """
+    Two-stage vector search: prefetch limit * PREFETCH_FACTOR candidates
+    on the quantized index, then rescore them at full precision
+    """
+    query_vector = query_embedding.tolist()
+    response = vector_db.query_points(
+        collection_name="documents",
+        prefetch=models.Prefetch(
+            query=query_vector,
+            limit=limit * PREFETCH_FACTOR,
+            params=PREFETCH_PARAMS,
+        ),
+        query=query_vector,
+        limit=limit,
+        score_threshold=score_threshold,
+        search_params=SEARCH_PARAMS,
+    )
+    return response.points
+
+def extract_page_texts(pdf_content: bytes, part: int, parts: int) -> Tuple[int, List[str]]:
+    """
+    Extract text for the part-th of `parts` contiguous page ranges.
+    Each call opens its own reader so worker threads never share a stream;
+    returns (total_pages, texts) so callers need no extra reader to count.
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
+    num_pages = len(reader.pages)
+    step = -(-num_pages // parts)
+    pages = range(part * step, min((part + 1) * step, num_pages))
+    return num_pages, [reader.pages[i].extract_text() for i in pages]
+
+def chunk_spans(text: str, chunk_size: int = 500, overlap: int = 50) -> List[Tuple[int, int]]:
+    """
+    Split text into overlapping windows of chunk_size words
+    Returns (start, end) character offsets into text, one pair per chunk
+    """
+    words = [m.span() for m in WORD_RE.finditer(text)]
+    spans = []
     
     for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        chunks.append(chunk)
+        last = min(i + chunk_size, len(words)) - 1
+        spans.append((words[i][0], words[last][1]))
+        
+        # Stop once a window reaches the last word, otherwise the tail
+        # would be emitted again as a chunk already covered by this one
+        if last == len(words) - 1:
+            break
     
-    return chunks
+    return spans
+
+def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
+    """Split text into overlapping chunks (slices of the original text)"""
+    return [text[start:end] for start, end in chunk_spans(text, chunk_size, overlap)]
 
 # ============================================================================
 # DOCUMENT PROCESSING
 # ============================================================================
 
+@app.on_event("startup")
+def warm_up_embedding_model():
+    """Run one dummy batch so the first request doesn't pay model warm-up"""
+    encode_texts(["warmup"] * 32, batch_size=32)
+
+@app.on_event("startup")
+def start_embedding_pool():
+    """Spread ingestion embedding over every visible GPU"""
+    global pool_model, embedding_pool
+    if torch.cuda.device_count() > 1:
+        # Separate instance, so embedding_model stays on the GPU for queries
+        pool_model = SentenceTransformer(EMBEDDING_MODEL_NAME).half()
+        embedding_pool = pool_model.start_multi_process_pool()
+
+@app.on_event("shutdown")
+def stop_embedding_pool():
+    if embedding_pool is not None:
+        pool_model.stop_multi_process_pool(embedding_pool)
+
+@app.on_event("startup")
+def ensure_collection():
+    """
+    Create the "documents" collection with int8 quantization if missing,
+    or add it to an existing collection created without quantization
+    """
+    global vector_quantization
+    if not vector_db.collection_exists("documents"):
+        vector_db.create_collection(
+            collection_name="documents",
+            vectors_config=models.VectorParams(
+                size=embedding_model.get_sentence_embedding_dimension(),
+                distance=models.Distance.COSINE,
+            ),
+            quantization_config=VECTOR_QUANTIZATION,
+            hnsw_config=models.HnswConfigDiff(m=16, ef_construct=128),
+        )
+    elif vector_db.get_collection("documents").config.quantization_config is None:
+        vector_db.update_collection(
+            collection_name="documents",
+            quantization_config=VECTOR_QUANTIZATION,
+        )
+    
+    # Report what the collection uses, not what this file asks for
+    config = vector_db.get_collection("documents").config.quantization_config
+    if isinstance(config, models.ScalarQuantization):
+        vector_quantization = config.scalar.type.value
+    elif config is not None:
+        vector_quantization = type(config).__name__
+
 @app.post("/api/documents/upload")
 async def upload_document(file: UploadFile = File(...)):
     """
@@ -136,49 +377,76 @@ async def upload_document(file: UploadFile = File(...)):
     
     # Read PDF
     pdf_content = await file.read()
-    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
     
-    chunks_with_metadata = []
+    # Extract page text off the event loop, one contiguous page range per
+    # pool worker (the shared pool is never shut down from here)
+    num_parts = PDF_EXTRACT_WORKERS if len(pdf_content) >= PDF_SPLIT_MIN_BYTES else 1
+    loop = asyncio.get_running_loop()
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(pdf_extract_pool, extract_page_texts, pdf_content, part, num_parts)
+        for part in range(num_parts)
+    ))
+    num_pages = parts[0][0]
+    page_texts = [text for _, texts in parts for text in texts]
+    
+    all_chunks = []
+    all_payloads = []
     
     # Process each page
-    for page_num, page in enumerate(pdf_reader.pages, 1):
-        page_text = page.extract_text()
-        
+    for page_num, page_text in enumerate(page_texts, 1):
         # Split page into chunks
-        page_chunks = chunk_text(page_text, chunk_size=500, overlap=50)
+        page_chunks = chunk_spans(page_text, chunk_size=500, overlap=50)
         
-        # Store each chunk with metadata
-        for chunk_idx, chunk in enumerate(page_chunks):
-            chunk_id = f"{file.filename}_page{page_num}_chunk{chunk_idx}"
-            
-            # Generate embedding
-            embedding = embedding_model.encode(chunk).tolist()
-            
-            chunks_with_metadata.append({
-                "id": chunk_id,
-                "vector": embedding,
-                "payload": {
-                    "document_name": file.filename,
-                    "page_number": page_num,
-                    "chunk_index": chunk_idx,
-                    "chunk_text": chunk,
-                    "total_chunks_in_page": len(page_chunks)
-                }
+        # Collect each chunk with metadata; embeddings are added below
+        for chunk_idx, (start, end) in enumerate(page_chunks):
+            chunk = page_text[start:end]
+            all_chunks.append(chunk)
+            all_payloads.append({
+                "id": f"{file.filename}_page{page_num}_chunk{chunk_idx}",
+                "document_name": file.filename,
+                "page_number": page_num,
+                "chunk_index": chunk_idx,
+                "chunk_text": chunk,
+                "chunk_start_offset": start,  # position of chunk_text within the page text
+                "total_chunks_in_page": len(page_chunks)
             })
     
-    # Store in Qdrant
-    vector_db.upsert(
-        collection_name="documents",
-        points=chunks_with_metadata
-    )
+    # Embed and store in batches. Each batch is upserted from a worker
+    # thread while the next one is being encoded, so Qdrant I/O overlaps
+    # the model and only one batch of points is held at a time.
+    pending_upsert = None
+    for start in range(0, len(all_chunks), UPSERT_BATCH_SIZE):
+        end = start + UPSERT_BATCH_SIZE
+        vectors = await asyncio.to_thread(encode_chunks, all_chunks[start:end])
+        # Qdrant ids must be integers or UUIDs: derive a stable UUID from the
+        # readable chunk id (kept in the payload), so re-uploads overwrite
+        points = [
+            models.PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, payload["id"])),
+                vector=vector.tolist(),
+                payload=payload,
+            )
+            for payload, vector in zip(all_payloads[start:end], vectors)
+        ]
+        
+        if pending_upsert is not None:
+            await pending_upsert
+        pending_upsert = asyncio.create_task(asyncio.to_thread(
+            vector_db.upsert,
+            collection_name="documents",
+            points=points,
+        ))
+    
+    if pending_upsert is not None:
+        await pending_upsert
     
     return {
         "success": True,
         "document": {
             "id": file.filename,
             "name": file.filename,
-            "pages": len(pdf_reader.pages),
-            "chunks": len(chunks_with_metadata),
+            "pages": num_pages,
+            "chunks": len(all_chunks),
             "status": "ready"
         }
     }
@@ -201,15 +469,18 @@ async def rag_query(request: QueryRequest):
     6. Return answer with sources and highlights
     """
     
-    # Step 1: Embed the query
-    query_embedding = embedding_model.encode(request.query).tolist()
+    # Model inference, Qdrant and OpenAI calls are blocking, so they run in
+    # worker threads / async clients to keep the event loop free
+    
+    # Step 1: Embed the query (reused for highlight scoring below)
+    query_embedding = (await asyncio.to_thread(encode_texts, [request.query]))[0]
     
     # Step 2: Search vector database
-    search_results = vector_db.search(
-        collection_name="documents",
-        query_vector=query_embedding,
+    search_results = await asyncio.to_thread(
+        search_chunks,
+        query_embedding,
         limit=request.maxSources,
-        score_threshold=0.5  # Only return chunks with similarity > 0.5
+        score_threshold=0.5,  # Only return chunks with similarity > 0.5
     )
     
     if not search_results:
@@ -223,13 +494,19 @@ async def rag_query(request: QueryRequest):
     sources = []
     context_for_llm = []
     
-    for idx, result in enumerate(search_results, 1):
+    # Extract highlights - most relevant sentences within each chunk,
+    # scored for all retrieved chunks in one batch
+    all_highlights = await asyncio.to_thread(
+        extract_highlights_batch,
+        [result.payload["chunk_text"] for result in search_results],
+        query_embedding,
+        max_highlights=3,
+    )
+    
+    for idx, (result, highlights) in enumerate(zip(search_results, all_highlights), 1):
         payload = result.payload
         chunk_text = payload["chunk_text"]
         
-        # Extract highlights - most relevant sentences within this chunk
-        highlights = extract_highlights(chunk_text, request.query, max_highlights=3)
-        
         source = DocumentSource(
             id=payload.get("id", f"chunk_{idx}"),
             documentName=payload["document_name"],
@@ -261,7 +538,7 @@ Example format:
 "The system uses JWT tokens for authentication [1]. This approach provides stateless authentication [1] and integrates with OAuth 2.0 providers [2]."
 """
     
-    response = openai.ChatCompletion.create(
+    response = await openai.ChatCompletion.acreate(
         model="gpt-4",
         messages=[
             {"role": "system", "content": system_prompt},
@@ -279,7 +556,8 @@ Example format:
             "processingTime": response.response_ms if hasattr(response, 'response_ms') else 0,
             "model": "gpt-4",
             "tokensUsed": response.usage.total_tokens,
-            "numChunksRetrieved": len(sources)
+            "numChunksRetrieved": len(sources),
+            "vectorQuantization": vector_quantization,
         }
     )
 
@@ -288,68 +566,114 @@ Example format:
 # ============================================================================
 
 from fastapi.responses import StreamingResponse
-import json
-import asyncio
+import orjson
+
+def sse(payload: Dict) -> bytes:
+    """
+    Frame a payload as one SSE event. orjson encodes straight to bytes in
+    a single call, so there is no json.dumps → str → utf-8 roundtrip.
+    """
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
 
 @app.post("/api/rag/stream")
 async def rag_stream(request: QueryRequest):
     """
     Streaming version - sends tokens as they're generated
+    
+    Sources are sent first with empty highlights so the LLM stream can start
+    right away. Highlights are extracted in the background and delivered as
+    {"type": "highlights", "chunkId": <source id>, "highlights": [...]}
+    events, interleaved with the token events as each one completes.
     """
     
     async def generate():
         # Step 1 & 2: Search (same as above)
-        query_embedding = embedding_model.encode(request.query).tolist()
-        search_results = vector_db.search(
-            collection_name="documents",
-            query_vector=query_embedding,
-            limit=request.maxSources,
+        query_embedding = (await asyncio.to_thread(encode_texts, [request.query]))[0]
+        search_results = await asyncio.to_thread(
+            search_chunks, query_embedding, limit=request.maxSources
         )
         
-        # Step 3: Format sources
-        sources = []
+        async def highlight_chunk(source_id: str, chunk_text: str):
+            highlights = await asyncio.to_thread(extract_highlights, chunk_text, query_embedding)
+            return source_id, highlights
+        
+        # Step 3: Format sources, starting highlight extraction for each
         context_for_llm = []
+        highlight_tasks = []
         
         for idx, result in enumerate(search_results, 1):
             payload = result.payload
             chunk_text = payload["chunk_text"]
-            highlights = extract_highlights(chunk_text, request.query)
             
             source = {
-                "id": payload.get("id"),
+                "id": payload.get("id", f"chunk_{idx}"),
                 "documentName": payload["document_name"],
                 "pageNumber": payload["page_number"],
                 "content": chunk_text,
                 "score": result.score,
                 "citationNumber": idx,
-                "highlights": highlights
+                "highlights": []
             }
             
-            sources.append(source)
+            highlight_tasks.append(asyncio.create_task(highlight_chunk(source["id"], chunk_text)))
             context_for_llm.append(f"[{idx}] {chunk_text}")
             
             # Send source immediately
-            yield f"data: {json.dumps({'type': 'source', 'source': source})}\n\n"
+            yield sse({'type': 'source', 'source': source})
         
-        # Step 4: Stream LLM response
+        # Step 4: Stream LLM response, with highlight events pushed into the
+        # same queue as soon as each extraction finishes
         context = "\n\n".join(context_for_llm)
+        events = asyncio.Queue()
         
-        stream = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "Answer based on context. Include citations [1], [2], etc."},
-                {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {request.query}"}
-            ],
-            stream=True
-        )
+        async def forward_highlights():
+            try:
+                for finished in asyncio.as_completed(highlight_tasks):
+                    source_id, highlights = await finished
+                    await events.put({"type": "highlights", "chunkId": source_id, "highlights": highlights})
+            finally:
+                await events.put(None)
         
-        for chunk in stream:
-            if chunk.choices[0].delta.get("content"):
-                token = chunk.choices[0].delta.content
-                yield f"data: {json.dumps({'type': 'token', 'content': token})}\n\n"
+        async def forward_tokens():
+            try:
+                stream = await openai.ChatCompletion.acreate(
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": "Answer based on context. Include citations [1], [2], etc."},
+                        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {request.query}"}
+                    ],
+                    stream=True
+                )
+                
+                async for chunk in stream:
+                    if chunk.choices[0].delta.get("content"):
+                        token = chunk.choices[0].delta.content
+                        await events.put({"type": "token", "content": token})
+            finally:
+                await events.put(None)
+        
+        producers = [
+            asyncio.create_task(forward_highlights()),
+            asyncio.create_task(forward_tokens()),
+        ]
+        try:
+            # Each producer puts None when it finishes
+            remaining = len(producers)
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield sse(event)
+            
+            # Surface any producer error
+            await asyncio.gather(*producers)
+        finally:
+            for task in producers + highlight_tasks:
+                task.cancel()
         
         # Send completion
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield sse({'type': 'done'})
     
     return StreamingResponse(generate(), media_type="text/event-stream")
 
@@ -364,10 +688,10 @@ if __name__ == "__main__":
 """
 To run:
 1. Install dependencies:
-   pip install fastapi uvicorn qdrant-client sentence-transformers openai PyPDF2 scikit-learn
+   pip install fastapi uvicorn qdrant-client sentence-transformers openai PyPDF2 orjson
 
 2. Start Qdrant:
-   docker run -p 6333:6333 qdrant/qdrant
+   docker run -p 6333:6333 -p 6334:6334 qdrant/qdrant
 
 3. Run server:
    python backend.py
@@ -11,13 +11,25 @@ Key patterns from PageIndex cookbooks:
   - include_page_ranges=True           → get start_index/end_index per node
 """
 
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from sse_starlette.sse import EventSourceResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Union
+from typing import List, Optional, Dict, Union, Iterator, Tuple, Callable, Iterable, AsyncIterator
+from itertools import chain
+from bisect import bisect_left
 import re
-import json
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import msgspec
+
+# Aho-Corasick multi-keyword matching (pip install pyahocorasick)
+import ahocorasick
+
+# TTL cache for per-document trees (pip install cachetools)
+from cachetools import TTLCache
 
 # PageIndex SDK
 from pageindex import PageIndexClient
@@ -37,6 +49,46 @@ app.add_middleware(
 # Initialize PageIndex client
 pi_client = PageIndexClient(api_key="YOUR_PAGEINDEX_API_KEY")
 
+# Per-document cache of (tree, page_map, flat_tree), see get_tree_bundle()
+TREE_CACHE_TTL = 300  # seconds
+tree_cache = TTLCache(maxsize=1024, ttl=TREE_CACHE_TTL)
+# TTLCache is not thread-safe and is read from worker threads (rag_stream)
+# as well as the event loop, so every access goes through tree_cache_lock.
+# tree_load_locks makes concurrent misses on one doc share a single get_tree.
+tree_cache_lock = threading.Lock()
+tree_load_locks: Dict[str, threading.Lock] = {}
+
+# Compiled once at import; these run per citation on every request
+CITATION_RE = re.compile(r'<doc=([^;]+);page=(\d+)>')
+WORD_RE = re.compile(r'\w+')
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Longest partial citation kept between streamed tokens, see split_citation_tail()
+CITATION_TAIL_LIMIT = 256
+
+# Streamed tokens are coalesced into one SSE event per ~1KB, or 30ms after
+# the oldest buffered token, whichever comes first, see rag_stream()
+TOKEN_FLUSH_BYTES = 1024
+TOKEN_FLUSH_INTERVAL = 0.03  # seconds
+
+# Upstream items buffered per stream before the reader waits for the
+# client, see iterate_in_thread()
+STREAM_BUFFER_SIZE = 32
+
+# Highlight extraction is pure-Python CPU work per cited section, so it runs
+# here instead of on the event loop that serves every open stream
+HIGHLIGHT_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="highlights")
+
+# Words ignored when extracting query keywords for highlights
+STOP_WORDS = frozenset({
+    "the", "a", "an", "is", "are", "was", "were", "what", "how", "why",
+    "when", "where", "which", "who", "do", "does", "did", "in", "on",
+    "at", "to", "for", "of", "and", "or", "but", "not", "this", "that",
+    "it", "can", "will", "be", "has", "have", "had", "with", "from",
+    "about", "than", "more", "most", "some", "any", "all", "each",
+    "would", "could", "should", "may", "might", "much", "many",
+})
+
 # ==========================================================================
 # IMPORTANT: What changed from Vector DB approach
 # ==========================================================================
@@ -96,10 +148,152 @@ class QueryResponse(BaseModel):
     metadata: Dict
 
 
+# ==========================================================================
+# SSE EVENT ENVELOPES (rag_stream)
+# ==========================================================================
+# The envelopes have a fixed shape, so they are msgspec Structs encoded by
+# one shared encoder rather than dicts: {"type": "<tag>", ...fields}
+
+class StreamEvent(msgspec.Struct, tag_field="type"):
+    pass
+
+class TokenEvent(StreamEvent, tag="token"):
+    content: str
+
+class ToolStartEvent(StreamEvent, tag="tool_start"):
+    metadata: Dict
+
+class ToolResultEvent(StreamEvent, tag="tool_result"):
+    metadata: Dict
+
+class SourceEvent(StreamEvent, tag="source"):
+    source: Dict
+
+class DoneEvent(StreamEvent, tag="done"):
+    pass
+
+event_encoder = msgspec.json.Encoder()
+
+
 # ==========================================================================
 # HELPER FUNCTIONS
 # ==========================================================================
 
+# Marks the end of a blocking iterator consumed by iterate_in_thread()
+_STREAM_END = object()
+
+# Yielded by iterate_in_thread() when a wait given by idle_timeout expires
+STREAM_IDLE = object()
+
+
+class _WaitExpired:
+    """Queued by the timer of one iterate_in_thread() wait"""
+    __slots__ = ()
+
+
+async def iterate_in_thread(
+    make_iterator: Callable[[], Iterable],
+    max_buffered: int = STREAM_BUFFER_SIZE,
+    idle_timeout: Optional[Callable[[], Optional[float]]] = None,
+) -> AsyncIterator:
+    """
+    Consume a blocking iterator from a worker thread.
+    
+    The PageIndex SDK streams through a synchronous generator; iterating it
+    directly inside an async endpoint would block the event loop for every
+    upstream network wait, stalling all other connected clients. Items are
+    handed back to the loop through a queue and yielded here instead.
+    Exceptions raised by the iterator are re-raised once it is drained.
+    
+    Each stream gets its own daemon thread rather than a default-executor
+    slot: a stream holds its worker for its whole lifetime, so a few dozen
+    open streams would otherwise exhaust the shared pool and stall new
+    streams along with every asyncio.to_thread call (tree lookups included).
+    
+    At most max_buffered items are in flight: when the client reads slowly
+    the worker blocks instead of queueing the whole answer in memory, which
+    in turn stops it reading from the upstream connection. That wait only
+    ever parks the stream's own thread, and it re-checks the stop flag
+    every second so an abandoned stream cannot hold its thread forever.
+    
+    idle_timeout, if given, is called before each wait and returns how many
+    seconds to wait for the next item (None waits indefinitely). If that
+    passes first, STREAM_IDLE is yielded so the caller can act on its own
+    deadline. The wait is bounded by a loop timer, not a task per item,
+    so iteration and cleanup all stay on the caller's task.
+    
+    Callers should aclose() this generator from the task that iterates it
+    (see rag_stream), so that when a client goes away the worker is told to
+    stop and the upstream generator is closed, instead of leaving cleanup
+    to garbage collection on some other task.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    credits = threading.Semaphore(max_buffered)
+    failure = []
+    
+    def pump():
+        iterator = None
+        try:
+            iterator = make_iterator()
+            for item in iterator:
+                while not credits.acquire(timeout=1.0) and not stop.is_set():
+                    pass
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            failure.append(e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            # Nobody is waiting for the end marker once the consumer has
+            # stopped, and its loop may already be closed (e.g. shutdown)
+            if not stop.is_set():
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+                except RuntimeError:
+                    pass
+    
+    threading.Thread(target=pump, name="pageindex-stream", daemon=True).start()
+    try:
+        while True:
+            timeout = idle_timeout() if idle_timeout is not None else None
+            expired = timer = None
+            if timeout is not None:
+                expired = _WaitExpired()
+                timer = loop.call_later(timeout, queue.put_nowait, expired)
+            item = await queue.get()
+            if timer is not None:
+                timer.cancel()
+            
+            if item is _STREAM_END:
+                break
+            if isinstance(item, _WaitExpired):
+                # A timer that fired just as an item arrived leaves a stale
+                # marker behind; only this wait's own marker counts
+                if item is expired:
+                    yield STREAM_IDLE
+                continue
+            credits.release()
+            yield item
+        if failure:
+            raise failure[0]
+    finally:
+        stop.set()
+        credits.release()  # wake the worker if it is waiting for room
+
+
+def sse(event: StreamEvent) -> bytes:
+    """
+    Frame an event as one SSE message. msgspec encodes straight to bytes,
+    which EventSourceResponse sends as-is without another utf-8 encode.
+    """
+    return b"data: " + event_encoder.encode(event) + b"\n\n"
+
+
 def parse_pageindex_citations(text: str) -> List[Dict]:
     """
     Parse PageIndex inline citations from the response text.
@@ -107,8 +301,7 @@ def parse_pageindex_citations(text: str) -> List[Dict]:
     
     Returns list of { documentName, pageNumber, raw }
     """
-    pattern = r'<doc=([^;]+);page=(\d+)>'
-    matches = re.findall(pattern, text)
+    matches = CITATION_RE.findall(text)
     
     citations = []
     for doc_name, page_num in matches:
@@ -121,6 +314,22 @@ def parse_pageindex_citations(text: str) -> List[Dict]:
     return citations
 
 
+def split_citation_tail(text: str) -> Tuple[str, str]:
+    """
+    Split the unprocessed end of a streaming answer into the part whose
+    citations are complete and a trailing "<..." that may still grow into
+    a citation.
+    
+    Returns (complete, remaining_tail). The tail is capped at
+    CITATION_TAIL_LIMIT chars, so the buffer stays small however long the
+    answer gets.
+    """
+    start = text.rfind("<")
+    if start == -1 or ">" in text[start:] or len(text) - start > CITATION_TAIL_LIMIT:
+        return text, ""
+    return text[:start], text[start:]
+
+
 def normalize_citations(text: str, citations: List[Dict]) -> tuple:
     """
     Convert PageIndex citations to [N] format for frontend.
@@ -128,24 +337,68 @@ def normalize_citations(text: str, citations: List[Dict]) -> tuple:
     Input:  "The data shows growth <doc=report.pdf;page=42> and stability <doc=report.pdf;page=21>"
     Output: "The data shows growth [1] and stability [2]"
     
-    Also returns a mapping: { "report.pdf_p42": 1, "report.pdf_p21": 2 }
-    """
-    normalized = text
-    citation_map = {}  # "filename_pN" -> citation number
+    Also returns a mapping: { ("report.pdf", 42): 1, ("report.pdf", 21): 2 }
     
+    Every match is rewritten by its (filename, page) key, so differently
+    spelled citations of the same page (page=2 / page=02) share one number.
+    """
+    citation_map = {}  # (filename, page) -> citation number
     for citation in citations:
-        key = f"{citation['documentName']}_p{citation['pageNumber']}"
+        key = (citation["documentName"], citation["pageNumber"])
         if key not in citation_map:
             citation_map[key] = len(citation_map) + 1
-        
-        num = citation_map[key]
-        normalized = normalized.replace(citation["raw"], f"[{num}]")
     
-    return normalized, citation_map
+    def number(match: re.Match) -> str:
+        num = citation_map.get((match.group(1), int(match.group(2))))
+        return f"[{num}]" if num else match.group(0)
+    
+    return CITATION_RE.sub(number, text), citation_map
+
+
+def iter_sentence_spans(text: str) -> Iterator[Tuple[str, int]]:
+    """
+    Split text into sentences, yielding (sentence, start_offset) pairs.
+    Offsets come straight from the split, so callers never need to
+    re-search the text (which also misfires on repeated sentences).
+    """
+    start = 0
+    for boundary in chain(SENTENCE_SPLIT_RE.finditer(text), [None]):
+        end = boundary.start() if boundary else len(text)
+        raw = text[start:end]
+        sentence = raw.strip()
+        if sentence:
+            yield sentence, start + len(raw) - len(raw.lstrip())
+        if boundary:
+            start = boundary.end()
+
+
+def build_keyword_automaton(query: str) -> Optional[ahocorasick.Automaton]:
+    """
+    Build an Aho-Corasick automaton over the meaningful query keywords.
+    
+    Every keyword occurrence in a sentence is then found in one linear
+    scan, instead of one substring search per keyword. Returns None when
+    the query has no usable keywords.
+    """
+    # Extract meaningful keywords (skip stop words), deduplicated in order
+    keywords = dict.fromkeys(
+        w.lower() for w in WORD_RE.findall(query)
+        if w.lower() not in STOP_WORDS and len(w) > 2
+    )
+    
+    if not keywords:
+        return None
+    
+    automaton = ahocorasick.Automaton()
+    for kw in keywords:
+        automaton.add_word(kw, kw)
+    automaton.make_automaton()
+    return automaton
 
 
 def extract_query_highlights(
-    text: str, query: str, max_highlights: int = 3
+    text: str, query: str, max_highlights: int = 3,
+    automaton: Optional[ahocorasick.Automaton] = None,
 ) -> List[Dict]:
     """
     Simple keyword-based highlight extraction.
@@ -157,50 +410,34 @@ def extract_query_highlights(
     This is simpler than the old cosine_similarity approach but works well
     enough because PageIndex already found the RIGHT section - we just need
     to find the most relevant sentences WITHIN that section.
+    
+    Pass a prebuilt `automaton` (see build_keyword_automaton) to reuse it
+    across several sections for the same query.
     """
     if not text or not query:
         return []
     
-    # Extract meaningful keywords (skip stop words)
-    stop_words = {
-        "the", "a", "an", "is", "are", "was", "were", "what", "how", "why",
-        "when", "where", "which", "who", "do", "does", "did", "in", "on",
-        "at", "to", "for", "of", "and", "or", "but", "not", "this", "that",
-        "it", "can", "will", "be", "has", "have", "had", "with", "from",
-        "about", "than", "more", "most", "some", "any", "all", "each",
-        "would", "could", "should", "may", "might", "much", "many",
-    }
-    
-    keywords = [
-        w.lower() for w in re.findall(r'\w+', query)
-        if w.lower() not in stop_words and len(w) > 2
-    ]
+    if automaton is None:
+        automaton = build_keyword_automaton(query)
+        if automaton is None:
+            return []
+    num_keywords = len(automaton)
     
-    if not keywords:
-        return []
-    
-    # Split into sentences
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    
-    # Score each sentence by keyword matches
+    # Score each sentence by the number of distinct keywords it contains
     scored_sentences = []
-    for sentence in sentences:
-        sentence = sentence.strip()
+    for sentence, start in iter_sentence_spans(text):
         if len(sentence) < 20:
             continue
         
-        sentence_lower = sentence.lower()
-        match_count = sum(1 for kw in keywords if kw in sentence_lower)
+        matched = {kw for _, kw in automaton.iter(sentence.lower())}
         
-        if match_count > 0:
-            start = text.find(sentence)
-            if start != -1:
-                scored_sentences.append({
-                    "text": sentence,
-                    "startOffset": start,
-                    "endOffset": start + len(sentence),
-                    "score": match_count / len(keywords),  # relevance ratio
-                })
+        if matched:
+            scored_sentences.append({
+                "text": sentence,
+                "startOffset": start,
+                "endOffset": start + len(sentence),
+                "score": len(matched) / num_keywords,  # relevance ratio
+            })
     
     # Sort by score (most keyword matches first) and return top N
     scored_sentences.sort(key=lambda x: x["score"], reverse=True)
@@ -211,49 +448,48 @@ def extract_query_highlights(
     ]
 
 
-def find_node_by_page(tree_nodes: list, page_num: int) -> Optional[Dict]:
+def flatten_tree(tree_nodes: list) -> Tuple[List[int], List[Dict]]:
     """
-    Find the PageIndex tree node that contains the given page number.
-    Searches recursively through the tree.
-    """
-    if not tree_nodes:
-        return None
+    Flatten the PageIndex tree once into nodes sorted by page_index.
     
-    for node in tree_nodes:
-        node_page = node.get("page_index")
-        if node_page == page_num:
-            return node
-        
-        # Check child nodes
-        if "nodes" in node and node["nodes"]:
-            result = find_node_by_page(node["nodes"], page_num)
-            if result:
-                return result
+    Returns (start_pages, nodes) as parallel lists, so each page lookup is
+    a bisect instead of a recursive walk. Uses an explicit stack rather
+    than recursion; the stable sort keeps tree order among equal pages.
+    """
+    flat = []
+    stack = list(reversed(tree_nodes or []))
+    while stack:
+        node = stack.pop()
+        flat.append(node)
+        stack.extend(reversed(node.get("nodes") or []))
     
-    return None
+    flat.sort(key=lambda n: n.get("page_index", 0))
+    return [n.get("page_index", 0) for n in flat], flat
 
 
-def find_closest_node(tree_nodes: list, page_num: int) -> Optional[Dict]:
+def find_node_by_page_in_flat(
+    flat_tree: Tuple[List[int], List[Dict]], page_num: int
+) -> Optional[Dict]:
     """
-    Find the closest tree node to a given page number.
-    Useful when exact page match isn't found.
+    Find the tree node starting at the given page number, or the node
+    whose starting page is closest when there is no exact match.
     """
-    closest = None
-    min_distance = float('inf')
+    starts, nodes = flat_tree
+    if not nodes:
+        return None
     
-    def search(nodes):
-        nonlocal closest, min_distance
-        for node in nodes:
-            node_page = node.get("page_index", 0)
-            distance = abs(node_page - page_num)
-            if distance < min_distance:
-                min_distance = distance
-                closest = node
-            if "nodes" in node and node["nodes"]:
-                search(node["nodes"])
+    i = bisect_left(starts, page_num)
+    if i < len(starts) and starts[i] == page_num:
+        return nodes[i]
     
-    search(tree_nodes)
-    return closest
+    # No exact match: pick the nearer of the two neighbouring start pages
+    if i == 0:
+        return nodes[0]
+    if i < len(starts) and starts[i] - page_num < page_num - starts[i - 1]:
+        return nodes[i]
+    # Several nodes can share the lower start page (a parent and its first
+    # child); like an exact match, take the first of them in tree order
+    return nodes[bisect_left(starts, starts[i - 1])]
 
 
 def build_node_map(tree: list, total_pages: Optional[int] = None) -> Dict:
@@ -269,24 +505,137 @@ def build_node_map(tree: list, total_pages: Optional[int] = None) -> Dict:
     return utils.create_node_mapping(tree, include_page_ranges=True, max_page=total_pages)
 
 
-def find_node_by_page_in_map(node_map: Dict, page_num: int) -> Optional[Dict]:
+def build_page_map(node_map: Dict) -> Dict[int, Dict]:
     """
-    Find a node containing a given page number using the flat node map.
-    Checks if page_num falls within [start_index, end_index] for each node.
-    """
-    best_match = None
-    smallest_range = float('inf')
+    Invert the node map into page_number → node map entry.
     
-    for node_id, entry in node_map.items():
+    Each page maps to the entry with the smallest [start_index, end_index]
+    range that contains it (the most specific section), so resolving a
+    cited page is a single dict lookup instead of a scan over all nodes.
+    Built once per document and cached alongside the tree.
+    """
+    page_map = {}
+    for entry in node_map.values():
         start = entry.get("start_index", 0)
         end = entry.get("end_index", 0)
-        if start <= page_num <= end:
-            page_range = end - start
-            if page_range < smallest_range:
-                smallest_range = page_range
-                best_match = entry["node"]
+        for page in range(start, end + 1):
+            current = page_map.get(page)
+            if current is None or end - start < current["end_index"] - current["start_index"]:
+                page_map[page] = {"node": entry["node"], "start_index": start, "end_index": end}
     
-    return best_match
+    return page_map
+
+
+def get_tree_bundle(doc_id: str) -> Tuple[list, Dict[int, Dict], Tuple[List[int], List[Dict]]]:
+    """
+    Fetch a document's tree along with its page map and flattened form.
+    
+    Trees only change when a document is re-ingested, so completed trees
+    are cached per doc_id (bounded by TREE_CACHE_TTL seconds) to skip the
+    get_tree round-trip and the map/flatten walks on every query.
+    Returns (tree, page_map, flat_tree); tree is empty if not ready yet.
+    """
+    with tree_cache_lock:
+        bundle = tree_cache.get(doc_id)
+        if bundle is not None:
+            return bundle
+        load_lock = tree_load_locks.setdefault(doc_id, threading.Lock())
+    
+    with load_lock:
+        try:
+            # Another request may have loaded it while this one waited
+            with tree_cache_lock:
+                bundle = tree_cache.get(doc_id)
+            if bundle is not None:
+                return bundle
+            
+            tree_response = pi_client.get_tree(doc_id, node_summary=True)
+            if tree_response.get("status") != "completed":
+                return [], {}, ([], [])
+            
+            tree = tree_response.get("result", []) or []
+            page_map = build_page_map(build_node_map(tree)) if tree else {}
+            bundle = (tree, page_map, flatten_tree(tree))
+            with tree_cache_lock:
+                tree_cache[doc_id] = bundle
+            return bundle
+        finally:
+            with tree_cache_lock:
+                if tree_load_locks.get(doc_id) is load_lock:
+                    del tree_load_locks[doc_id]
+
+
+def build_source(
+    citation: Dict,
+    citation_num: int,
+    page_map: Dict[int, Dict],
+    flat_tree: Tuple[List[int], List[Dict]],
+    query: str,
+    automaton: Optional[ahocorasick.Automaton],
+) -> Dict:
+    """
+    Build the streamed source payload for one citation.
+    
+    Resolves the cited page to its tree node (page map first, flattened
+    tree as fallback) and extracts keyword highlights from the section.
+    """
+    page = citation["pageNumber"]
+    node = None
+    end_page = page
+    if page_map:
+        entry = page_map.get(page)
+        if entry:
+            node = entry["node"]
+            end_page = entry["end_index"]
+    else:
+        node = find_node_by_page_in_flat(flat_tree, page)
+    
+    section_text = node.get("text", "") if node else ""
+    highlights = (
+        extract_query_highlights(section_text, query, automaton=automaton)
+        if automaton else []
+    )
+    
+    return {
+        "id": f"{citation['documentName']}_{node.get('node_id', 'unknown') if node else 'unknown'}",
+        "nodeId": node.get("node_id") if node else None,
+        "title": node.get("title", f"Page {page}") if node else f"Page {page}",
+        "documentName": citation["documentName"],
+        "pageIndex": page,
+        "endPageIndex": end_page,
+        "content": section_text,
+        "summary": node.get("summary", node.get("prefix_summary", "")) if node else "",
+        "citationNumber": citation_num,
+        "highlights": highlights,
+    }
+
+
+def iter_source_events(
+    text: str,
+    seen_keys: set,
+    page_map: Dict[int, Dict],
+    flat_tree: Tuple[List[int], List[Dict]],
+    query: str,
+    automaton: Optional[ahocorasick.Automaton],
+) -> Iterator[bytes]:
+    """
+    Yield one encoded source event per citation in text not already in
+    seen_keys, numbered in the order first seen.
+    
+    Finding, dedup, node lookup and encoding happen in a single pass per
+    match, with no intermediate citation lists. seen_keys is updated in
+    place so numbering carries across calls for the same answer.
+    """
+    for match in CITATION_RE.finditer(text):
+        doc_name, page_num = match.groups()
+        key = (doc_name, int(page_num))
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        
+        citation = {"documentName": doc_name, "pageNumber": key[1], "raw": match.group(0)}
+        source = build_source(citation, len(seen_keys), page_map, flat_tree, query, automaton)
+        yield sse(SourceEvent(source=source))
 
 
 # ==========================================================================
@@ -367,6 +716,8 @@ async def list_documents(limit: int = 50, offset: int = 0):
 async def delete_document(doc_id: str):
     """Delete a document from PageIndex"""
     pi_client.delete_document(doc_id)
+    with tree_cache_lock:
+        tree_cache.pop(doc_id, None)
     return {"success": True}
 
 
@@ -404,8 +755,12 @@ async def rag_query(request: QueryRequest):
     
     raw_answer = response["choices"][0]["message"]["content"]
     
-    # Step 2: Parse PageIndex citations
-    citations = parse_pageindex_citations(raw_answer)
+    # Step 2: Parse PageIndex citations, keeping one per (document, page)
+    # so each section lookup and highlight pass below runs at most once
+    unique_citations = {}
+    for citation in parse_pageindex_citations(raw_answer):
+        unique_citations.setdefault((citation["documentName"], citation["pageNumber"]), citation)
+    citations = list(unique_citations.values())
     
     # Step 3: Normalize citations to [N] format
     normalized_answer, citation_map = normalize_citations(raw_answer, citations)
@@ -414,47 +769,38 @@ async def rag_query(request: QueryRequest):
     sources = []
     
     if citations:
-        # Get tree structure and build flat node map for O(1) lookups
+        # Get tree structure and its page → node map for O(1) lookups
         tree = None
-        node_map = {}
+        flat_tree = ([], [])
+        page_map = {}
         
         if request.docId:
             doc_id = request.docId if isinstance(request.docId, str) else request.docId[0]
             try:
-                tree_response = pi_client.get_tree(doc_id, node_summary=True)
-                if tree_response.get("status") == "completed":
-                    tree = tree_response.get("result", [])
-                    if tree:
-                        # Cookbook pattern: build flat node map for fast lookup
-                        node_map = build_node_map(tree)
+                # Cookbook pattern: flat node map for fast lookup (cached per doc)
+                tree, page_map, flat_tree = await asyncio.to_thread(get_tree_bundle, doc_id)
             except Exception:
                 tree = None
         
-        seen_keys = set()
+        # One keyword automaton per query, and one highlight pass per
+        # section when several cited pages resolve to the same node
+        automaton = build_keyword_automaton(request.query)
+        section_highlights = {}
+        
         for citation in citations:
-            key = f"{citation['documentName']}_p{citation['pageNumber']}"
-            if key in seen_keys:
-                continue
-            seen_keys.add(key)
+            citation_num = citation_map[(citation["documentName"], citation["pageNumber"])]
             
-            citation_num = citation_map[key]
-            
-            # Try to find the tree node for this page
+            # Try to find the tree node for this page, along with the
+            # section's page range when the page map has it
             node = None
-            node_entry = None
-            if node_map:
-                node = find_node_by_page_in_map(node_map, citation["pageNumber"])
-            elif tree:
-                node = find_node_by_page(tree, citation["pageNumber"])
-                if not node:
-                    node = find_closest_node(tree, citation["pageNumber"])
-            
-            # Get page range from node map if available
             end_page = citation["pageNumber"]
-            if node and node_map:
-                node_id = node.get("node_id", "")
-                if node_id in node_map:
-                    end_page = node_map[node_id].get("end_index", citation["pageNumber"])
+            if page_map:
+                entry = page_map.get(citation["pageNumber"])
+                if entry:
+                    node = entry["node"]
+                    end_page = entry["end_index"]
+            elif tree:
+                node = find_node_by_page_in_flat(flat_tree, citation["pageNumber"])
             
             # Extract the section text and metadata
             section_text = node.get("text", "") if node else ""
@@ -464,7 +810,15 @@ async def rag_query(request: QueryRequest):
             node_id = node.get("node_id", f"page_{citation['pageNumber']}") if node else f"page_{citation['pageNumber']}"
             
             # Extract keyword-based highlights within the section
-            highlights = extract_query_highlights(section_text, request.query)
+            if node_id not in section_highlights:
+                section_highlights[node_id] = (
+                    await asyncio.get_running_loop().run_in_executor(
+                        HIGHLIGHT_POOL, extract_query_highlights,
+                        section_text, request.query, 3, automaton,
+                    )
+                    if automaton else []
+                )
+            highlights = section_highlights[node_id]
             
             sources.append(DocumentSource(
                 id=f"{citation['documentName']}_{node_id}",
@@ -495,7 +849,7 @@ async def rag_query(request: QueryRequest):
 # ==========================================================================
 
 @app.post("/api/rag/stream")
-async def rag_stream(request: QueryRequest):
+async def rag_stream(request: QueryRequest, http_request: Request):
     """
     Streaming version using PageIndex Chat API.
     
@@ -508,108 +862,144 @@ async def rag_stream(request: QueryRequest):
       - mcp_tool_use_start (PageIndex is searching the document)
       - mcp_tool_result_start (PageIndex found relevant content)
       - text_block_start / text_stop (text content blocks)
+    
+    If the client disconnects mid-answer the upstream stream is closed
+    right away rather than drained, so no further PageIndex tokens are spent.
     """
     
+    doc_id = None
+    if request.docId:
+        doc_id = request.docId if isinstance(request.docId, str) else request.docId[0]
+    
+    def load_tree_lookups():
+        """Page map + flattened tree for the document (cached per doc_id)"""
+        _, page_map, flat_tree = get_tree_bundle(doc_id)
+        return page_map, flat_tree
+    
     async def generate():
-        full_answer = ""
+        # Fetch the tree while PageIndex starts answering, so the node
+        # lookups are ready by the time the first citation streams in
+        lookup_task = None
+        if request.enableCitations and doc_id:
+            lookup_task = asyncio.create_task(asyncio.to_thread(load_tree_lookups))
+        
+        async def tree_lookups():
+            if lookup_task is None:
+                return {}, ([], [])
+            try:
+                return await lookup_task
+            except Exception:
+                return {}, ([], [])
+        
+        automaton = build_keyword_automaton(request.query) if request.enableCitations else None
+        seen_keys = set()  # (documentName, pageNumber)
+        
+        # Only the unparsed end of the answer is kept: citations are sent
+        # as soon as they are complete instead of after the whole answer
+        tail = ""
+        
+        # Sub-word tokens are buffered and sent as one event per flush: when
+        # TOKEN_FLUSH_BYTES are pending, or TOKEN_FLUSH_INTERVAL after the
+        # oldest pending token arrived, whichever comes first
+        pending = []
+        pending_len = 0
+        flush_deadline = 0.0
+        
+        def flush_tokens() -> bytes:
+            nonlocal pending_len
+            event = sse(TokenEvent(content="".join(pending)))
+            pending.clear()
+            pending_len = 0
+            return event
         
-        # Stream from PageIndex
-        for chunk in pi_client.chat_completions(
+        def time_to_flush() -> Optional[float]:
+            # Wait for the next upstream item only until pending tokens are
+            # due, so a slow upstream never holds them back
+            return max(0.0, flush_deadline - time.monotonic()) if pending else None
+        
+        # Stream from PageIndex (sync SDK iterator, consumed off the loop).
+        # Closed explicitly below so cleanup runs on this request's task.
+        upstream = iterate_in_thread(lambda: pi_client.chat_completions(
             messages=[{"role": "user", "content": request.query}],
             doc_id=request.docId,
             stream=True,
             stream_metadata=True,
             enable_citations=request.enableCitations,
-        ):
-            # Handle metadata events (tool calls)
-            metadata = chunk.get("block_metadata", {}) if isinstance(chunk, dict) else {}
-            if metadata:
-                block_type = metadata.get("type")
-                
-                if block_type == "mcp_tool_use_start":
-                    # PageIndex is searching the document tree
-                    yield f"data: {json.dumps({'type': 'tool_start', 'metadata': {'toolName': metadata.get('tool_name', 'search'), 'type': block_type}})}\n\n"
-                    continue
-                
-                elif block_type == "mcp_tool_result_start":
-                    # PageIndex found relevant content
-                    yield f"data: {json.dumps({'type': 'tool_result', 'metadata': {'type': block_type}})}\n\n"
+        ), idle_timeout=time_to_flush)
+        try:
+            async for chunk in upstream:
+                if chunk is STREAM_IDLE:
+                    yield flush_tokens()
                     continue
-            
-            # Handle content tokens
-            content = ""
-            if isinstance(chunk, str):
-                content = chunk
-            elif isinstance(chunk, dict):
-                content = chunk.get("choices", [{}])[0].get("delta", {}).get("content", "")
-            
-            if content:
-                full_answer += content
-                yield f"data: {json.dumps({'type': 'token', 'content': content})}\n\n"
-        
-        # After streaming is done, parse citations and send sources
-        if request.enableCitations:
-            citations = parse_pageindex_citations(full_answer)
-            
-            if citations:
-                # Get tree and build flat node map for fast lookups
-                tree = None
-                node_map = {}
-                if request.docId:
-                    doc_id = request.docId if isinstance(request.docId, str) else request.docId[0]
-                    try:
-                        tree_response = pi_client.get_tree(doc_id, node_summary=True)
-                        if tree_response.get("status") == "completed":
-                            tree = tree_response.get("result", [])
-                            if tree:
-                                node_map = build_node_map(tree)
-                    except Exception:
-                        pass
                 
-                seen_keys = set()
-                citation_num = 0
+                if await http_request.is_disconnected():
+                    return
                 
-                for citation in citations:
-                    key = f"{citation['documentName']}_p{citation['pageNumber']}"
-                    if key in seen_keys:
-                        continue
-                    seen_keys.add(key)
-                    citation_num += 1
-                    
-                    # Use flat node map for O(1) lookup
-                    node = None
-                    end_page = citation["pageNumber"]
-                    if node_map:
-                        node = find_node_by_page_in_map(node_map, citation["pageNumber"])
-                        if node and node.get("node_id") in node_map:
-                            end_page = node_map[node["node_id"]].get("end_index", end_page)
-                    elif tree:
-                        node = find_node_by_page(tree, citation["pageNumber"])
-                        if not node:
-                            node = find_closest_node(tree, citation["pageNumber"])
+                # Handle metadata events (tool calls)
+                metadata = chunk.get("block_metadata", {}) if isinstance(chunk, dict) else {}
+                if metadata:
+                    block_type = metadata.get("type")
+                    if pending and block_type in ("mcp_tool_use_start", "mcp_tool_result_start"):
+                        yield flush_tokens()
                     
-                    section_text = node.get("text", "") if node else ""
-                    highlights = extract_query_highlights(section_text, request.query)
-                    
-                    source = {
-                        "id": f"{citation['documentName']}_{node.get('node_id', 'unknown') if node else 'unknown'}",
-                        "nodeId": node.get("node_id") if node else None,
-                        "title": node.get("title", f"Page {citation['pageNumber']}") if node else f"Page {citation['pageNumber']}",
-                        "documentName": citation["documentName"],
-                        "pageIndex": citation["pageNumber"],
-                        "endPageIndex": end_page,
-                        "content": section_text,
-                        "summary": node.get("summary", node.get("prefix_summary", "")) if node else "",
-                        "citationNumber": citation_num,
-                        "highlights": highlights,
-                    }
+                    if block_type == "mcp_tool_use_start":
+                        # PageIndex is searching the document tree
+                        yield sse(ToolStartEvent(metadata={'toolName': metadata.get('tool_name', 'search'), 'type': block_type}))
+                        continue
                     
-                    yield f"data: {json.dumps({'type': 'source', 'source': source})}\n\n"
+                    elif block_type == "mcp_tool_result_start":
+                        # PageIndex found relevant content
+                        yield sse(ToolResultEvent(metadata={'type': block_type}))
+                        continue
+                
+                # Handle content tokens
+                content = ""
+                if isinstance(chunk, str):
+                    content = chunk
+                elif isinstance(chunk, dict):
+                    content = chunk.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                
+                if not content:
+                    continue
+                if not pending:
+                    flush_deadline = time.monotonic() + TOKEN_FLUSH_INTERVAL
+                pending.append(content)
+                pending_len += len(content)
+                if pending_len >= TOKEN_FLUSH_BYTES:
+                    yield flush_tokens()
+                
+                if not request.enableCitations:
+                    continue
+                
+                # Send a source the moment a new citation is complete
+                complete, tail = split_citation_tail(tail + content)
+                if "<doc=" not in complete:
+                    continue
+                page_map, flat_tree = await tree_lookups()
+                # Lookup + highlights + encoding run on the highlight pool
+                events = await asyncio.get_running_loop().run_in_executor(
+                    HIGHLIGHT_POOL, list, iter_source_events(
+                        complete, seen_keys, page_map, flat_tree, request.query, automaton
+                    )
+                )
+                for event in events:
+                    if pending:
+                        yield flush_tokens()
+                    yield event
+        finally:
+            await upstream.aclose()
+            if lookup_task is not None:
+                lookup_task.cancel()
+        
+        if pending:
+            yield flush_tokens()
         
         # Send done signal
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield sse(DoneEvent())
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    # EventSourceResponse adds the anti-buffering headers proxies need for
+    # token-by-token delivery, plus keepalive pings during long tool calls
+    return EventSourceResponse(generate(), ping=15)
 
 
 # ==========================================================================
@@ -627,7 +1017,7 @@ SETUP INSTRUCTIONS
 ==========================================================================
 
 1. Install dependencies:
-   pip install fastapi uvicorn pageindex
+   pip install fastapi uvicorn pageindex pyahocorasick cachetools msgspec sse-starlette
 
 2. Get your PageIndex API key:
    Visit https://dash.pageindex.ai/ and generate an API key
@@ -4,15 +4,15 @@ Example FastAPI backend that streams tool call events to the frontend.
 This shows how to emit Server-Sent Events (SSE) that the frontend
 streaming service can consume to show tool calling steps in the UI.
 
-Install: pip install fastapi uvicorn sse-starlette
+Install: pip install fastapi uvicorn sse-starlette orjson
 
 Run: uvicorn backend_streaming:app --reload
 """
 
 import asyncio
-import json
+import orjson
 import uuid
-from typing import AsyncGenerator
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sse_starlette.sse import EventSourceResponse
@@ -28,13 +28,176 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# content_delta chunks are coalesced into one event per ~1KB, or 30ms after
+# the first chunk of the batch, whichever comes first: each event costs an
+# ASGI send and a chunk frame, see coalesce_deltas()
+DELTA_FLUSH_BYTES = 1024
+DELTA_FLUSH_INTERVAL = 0.03  # seconds
 
-def create_sse_event(event_type: str, data: dict) -> str:
-    """Create a properly formatted SSE event."""
-    return json.dumps({"type": event_type, "data": data})
+
+def create_sse_event(event_type: str, data: dict) -> bytes:
+    """
+    Create a properly formatted SSE event. Framed as bytes here so
+    EventSourceResponse sends it as-is, with no str → utf-8 re-encode.
+    """
+    return b"data: " + orjson.dumps({"type": event_type, "data": data}) + b"\n\n"
+
+
+# The demo sources are fixed, so their event is serialized once at import
+SOURCES = [
+    {
+        "id": "source-1",
+        "documentName": "Technical Guide.pdf",
+        "pageIndex": 42,
+        "title": "Core Concepts",
+        "content": "This section explains the fundamental concepts...",
+        "citationNumber": 1,
+    },
+    {
+        "id": "source-2", 
+        "documentName": "API Reference.pdf",
+        "pageIndex": 15,
+        "title": "Implementation Details",
+        "content": "The API provides several methods for...",
+        "citationNumber": 2,
+    },
+    {
+        "id": "source-3",
+        "documentName": "Best Practices.pdf", 
+        "pageIndex": 8,
+        "title": "Recommended Approaches",
+        "content": "When implementing this feature, consider...",
+        "citationNumber": 3,
+    },
+]
+
+SOURCES_EVENT = create_sse_event("sources", {"sources": SOURCES})
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+# Simulated (duration, output) per demo tool; replace with real calls
+# such as httpx.AsyncClient requests
+DEMO_TOOL_RESULTS = {
+    "search_documents": (1.0, "Found 3 relevant documents: 'Technical Guide.pdf', 'API Reference.pdf', 'Best Practices.pdf'"),
+    "fetch_data": (0.7, "Found 2 related entries in the knowledge base"),
+    "retrieve_context": (0.8, "Retrieved 8 relevant passages from 3 documents"),
+    "analyze_content": (0.6, "Analysis complete. Generating response..."),
+}
+
+
+async def _run_tool(tool_id: str, tool_name: str, tool_input: dict) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Execute one tool call, returning (tool_id, output, error).
+    Failures are returned rather than raised so one failing tool
+    does not cancel the others running alongside it.
+    """
+    try:
+        duration, output = DEMO_TOOL_RESULTS[tool_name]
+        await asyncio.sleep(duration)  # Simulate tool execution time
+        return tool_id, output, None
+    except Exception as e:
+        return tool_id, None, str(e)
+
+
+async def run_tool_stage(calls: List[Tuple[str, dict]]) -> AsyncGenerator[bytes, None]:
+    """
+    Run one stage of the tool pipeline: (tool_name, input) calls that do
+    not depend on each other. They are dispatched together, so the stage
+    takes as long as its slowest tool, and each tool_end (or tool_error)
+    is emitted as soon as that tool finishes. Dependent steps go in
+    separate stages, run one after another.
+    """
+    plan = [(str(uuid.uuid4()), tool_name, tool_input) for tool_name, tool_input in calls]
+    
+    # Emit every tool_start in the stage up front
+    for tool_id, tool_name, tool_input in plan:
+        yield create_sse_event("tool_start", {
+            "tool_call_id": tool_id,
+            "tool_name": tool_name,
+            "input": tool_input
+        })
+    
+    tasks = [asyncio.create_task(_run_tool(*step)) for step in plan]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            tool_id, output, error = await finished
+            if error:
+                yield create_sse_event("tool_error", {"tool_call_id": tool_id, "error": error})
+            else:
+                yield create_sse_event("tool_end", {"tool_call_id": tool_id, "output": output})
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def simulate_token_stream(text: str, chunk_size: int = 20) -> AsyncIterator[str]:
+    """Simulate LLM token streaming: one chunk every 50ms"""
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
+        await asyncio.sleep(0.05)  # Small delay between chunks
+
+
+async def coalesce_deltas(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Re-batch a stream of text chunks. A batch is yielded once it reaches
+    DELTA_FLUSH_BYTES, or DELTA_FLUSH_INTERVAL after its first chunk
+    arrived, even if the source has gone quiet in the meantime.
+    
+    One producer task reads the source into a queue for the whole stream;
+    each wait on the queue is bounded by a loop timer that drops a marker
+    into it, so no task is created per chunk.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    end = object()
+    
+    async def produce():
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        finally:
+            queue.put_nowait(end)
+    
+    producer = asyncio.create_task(produce())
+    buf = []
+    buf_len = 0
+    deadline = 0.0
+    try:
+        while True:
+            # Wait for the next chunk, but only until the batch is due
+            expired = timer = None
+            if buf:
+                expired = object()
+                timer = loop.call_at(deadline, queue.put_nowait, expired)
+            item = await queue.get()
+            if timer is not None:
+                timer.cancel()
+            
+            if item is end:
+                break
+            if item is not expired:
+                if not isinstance(item, str):
+                    continue  # stale marker from a timer that fired late
+                if not buf:
+                    deadline = loop.time() + DELTA_FLUSH_INTERVAL
+                buf.append(item)
+                buf_len += len(item)
+                if buf_len < DELTA_FLUSH_BYTES:
+                    continue
+            
+            yield "".join(buf)
+            buf.clear()
+            buf_len = 0
+        
+        await producer  # surface errors from the source
+    finally:
+        producer.cancel()
+    
+    if buf:
+        yield "".join(buf)
 
 
-async def process_chat_with_tools(message: str) -> AsyncGenerator[str, None]:
+async def process_chat_with_tools(message: str) -> AsyncGenerator[bytes, None]:
     """
     Generator that yields SSE events as the LLM processes the request.
     
@@ -48,61 +211,29 @@ async def process_chat_with_tools(message: str) -> AsyncGenerator[str, None]:
     """
     
     # ===========================================
-    # STEP 1: Search Documents Tool
+    # STEP 1: Search (independent searches run concurrently)
     # ===========================================
-    tool_id_1 = str(uuid.uuid4())
-    
-    # Emit tool_start
-    yield create_sse_event("tool_start", {
-        "tool_call_id": tool_id_1,
-        "tool_name": "search_documents",
-        "input": {"query": message, "limit": 5}
-    })
-    
-    # Simulate tool execution time
-    await asyncio.sleep(1.0)
-    
-    # Emit tool_end with results
-    yield create_sse_event("tool_end", {
-        "tool_call_id": tool_id_1,
-        "output": "Found 3 relevant documents: 'Technical Guide.pdf', 'API Reference.pdf', 'Best Practices.pdf'"
-    })
+    async for event in run_tool_stage([
+        ("search_documents", {"query": message, "limit": 5}),
+        ("fetch_data", {"source": "knowledge_base", "query": message}),
+    ]):
+        yield event
     
     # ===========================================
-    # STEP 2: Retrieve Context Tool
+    # STEP 2: Retrieve Context Tool (needs the search results)
     # ===========================================
-    tool_id_2 = str(uuid.uuid4())
-    
-    yield create_sse_event("tool_start", {
-        "tool_call_id": tool_id_2,
-        "tool_name": "retrieve_context",
-        "input": {"document_ids": ["doc-1", "doc-2", "doc-3"], "max_chunks": 10}
-    })
-    
-    await asyncio.sleep(0.8)
-    
-    yield create_sse_event("tool_end", {
-        "tool_call_id": tool_id_2,
-        "output": "Retrieved 8 relevant passages from 3 documents"
-    })
+    async for event in run_tool_stage([
+        ("retrieve_context", {"document_ids": ["doc-1", "doc-2", "doc-3"], "max_chunks": 10}),
+    ]):
+        yield event
     
     # ===========================================
-    # STEP 3: Analyze Content Tool (optional)
+    # STEP 3: Analyze Content Tool (needs the retrieved context)
     # ===========================================
-    tool_id_3 = str(uuid.uuid4())
-    
-    yield create_sse_event("tool_start", {
-        "tool_call_id": tool_id_3,
-        "tool_name": "analyze_content",
-        "input": {"task": "summarize_and_answer"}
-    })
-    
-    await asyncio.sleep(0.6)
-    
-    yield create_sse_event("tool_end", {
-        "tool_call_id": tool_id_3,
-        "output": "Analysis complete. Generating response..."
-    })
+    async for event in run_tool_stage([
+        ("analyze_content", {"task": "summarize_and_answer"}),
+    ]):
+        yield event
     
     # ===========================================
     # STEP 4: Stream the response content
@@ -124,44 +255,15 @@ The documents contain detailed information about your query: "{message}"
 Based on all sources [1][2][3], the recommended approach is to follow the established patterns while adapting to your specific use case.
 """
     
-    # Stream content in chunks (simulating LLM token streaming)
-    chunk_size = 20
-    for i in range(0, len(response_text), chunk_size):
-        chunk = response_text[i:i + chunk_size]
-        yield create_sse_event("content_delta", {"delta": chunk})
-        await asyncio.sleep(0.05)  # Small delay between chunks
+    # Stream content, batching the small simulated tokens before they go
+    # out as content_delta events
+    async for delta in coalesce_deltas(simulate_token_stream(response_text)):
+        yield create_sse_event("content_delta", {"delta": delta})
     
     # ===========================================
     # STEP 5: Send sources
     # ===========================================
-    sources = [
-        {
-            "id": "source-1",
-            "documentName": "Technical Guide.pdf",
-            "pageIndex": 42,
-            "title": "Core Concepts",
-            "content": "This section explains the fundamental concepts...",
-            "citationNumber": 1,
-        },
-        {
-            "id": "source-2", 
-            "documentName": "API Reference.pdf",
-            "pageIndex": 15,
-            "title": "Implementation Details",
-            "content": "The API provides several methods for...",
-            "citationNumber": 2,
-        },
-        {
-            "id": "source-3",
-            "documentName": "Best Practices.pdf", 
-            "pageIndex": 8,
-            "title": "Recommended Approaches",
-            "content": "When implementing this feature, consider...",
-            "citationNumber": 3,
-        },
-    ]
-    
-    yield create_sse_event("sources", {"sources": sources})
+    yield SOURCES_EVENT
     
     # ===========================================
     # STEP 6: Signal completion
@@ -185,9 +287,17 @@ async def chat_endpoint(request: Request):
     message = body.get("message", "")
     
     async def event_generator():
-        async for event in process_chat_with_tools(message):
-            yield {"data": event}
-        yield {"data": "[DONE]"}
+        # Stop as soon as the client goes away, closing the tool pipeline
+        # (and cancelling its running tools) instead of draining it
+        events = process_chat_with_tools(message)
+        try:
+            async for event in events:
+                if await request.is_disconnected():
+                    return
+                yield event
+        finally:
+            await events.aclose()
+        yield DONE_EVENT
     
     return EventSourceResponse(event_generator())
 
@@ -195,7 +305,7 @@ async def chat_endpoint(request: Request):
 # ===========================================
 # Example with error handling
 # ===========================================
-async def process_with_error_example(message: str) -> AsyncGenerator[str, None]:
+async def process_with_error_example(message: str) -> AsyncGenerator[bytes, None]:
     """Example showing how to handle tool errors."""
     
     tool_id = str(uuid.uuid4())
@@ -4,6 +4,7 @@ import { useState, useCallback } from 'react';
 import { ragService } from '../services/rag.service';
 import { RAGQueryRequest, RAGQueryResponse } from '@/types/api';
 import { Message } from '@/components/chat/ChatMessage';
+import { HighlightRegion } from '@/types/message';
 
 interface UseRAGQueryOptions {
   onSuccess?: (response: RAGQueryResponse) => void;
@@ -46,11 +47,13 @@ export function useRAGQuery(options?: UseRAGQueryOptions) {
  *   - tool_result: "Found relevant content" (PageIndex located sections)
  *   - token: Answer text
  *   - source: Document source with nodeId, title, pageIndex, highlights
+ *   - highlights: Highlights for a source sent earlier without them (by source id)
  *   - done: Stream complete
  */
 interface UseRAGStreamOptions {
   onToken?: (token: string) => void;
   onSource?: (source: any) => void;
+  onHighlights?: (sourceId: string, highlights: HighlightRegion[]) => void;
   onComplete?: () => void;
   onError?: (error: string) => void;
   onToolStart?: (metadata: { toolName: string; type: string }) => void;
@@ -85,6 +88,11 @@ export function useRAGStream(options?: UseRAGStreamOptions) {
                 options?.onSource?.(chunk.source);
               }
               break;
+            case 'highlights':
+              if (chunk.chunkId && chunk.highlights) {
+                options?.onHighlights?.(chunk.chunkId, chunk.highlights);
+              }
+              break;
             case 'tool_start':
               // PageIndex is searching the document tree
               setIsSearching(true);
@@ -168,6 +176,18 @@ export function useChat(options?: UseChatOptions) {
         return newMessages;
       });
     },
+    onHighlights: (sourceId, highlights) => {
+      // Fill in highlights for a source already on the last assistant message
+      setMessages((prev) => {
+        const newMessages = [...prev];
+        const lastMessage = newMessages[newMessages.length - 1];
+        const source = lastMessage?.sources?.find((s) => s.id === sourceId);
+        if (lastMessage && lastMessage.role === 'assistant' && source) {
+          source.highlights = highlights;
+        }
+        return newMessages;
+      });
+    },
   });
 
   const sendMessage = useCallback(
@@ -1,4 +1,4 @@
-import { DocumentSource, PageIndexCitation } from '@/types/message';
+import { DocumentSource, HighlightRegion, PageIndexCitation } from '@/types/message';
 
 // RAG Query Request
 export interface RAGQueryRequest {
@@ -27,9 +27,12 @@ export interface RAGQueryResponse {
 
 // Stream Response Chunk (updated for PageIndex SSE format)
 export interface StreamChunk {
-  type: 'token' | 'source' | 'done' | 'error' | 'tool_start' | 'tool_result';
+  type: 'token' | 'source' | 'highlights' | 'done' | 'error' | 'tool_start' | 'tool_result';
   content?: string;
   source?: DocumentSource;
+  // 'highlights': late highlights for a source already sent (matched by source id)
+  chunkId?: string;
+  highlights?: HighlightRegion[];
   error?: string;
   // PageIndex streaming metadata
   metadata?: {